@@ -4,6 +4,9 @@ import argparse
 from pathlib import Path
 import subprocess
 from datetime import datetime, timedelta
+from metricas import RUN_METRICS, CallProfiler, export_report
+
+SRT_TIME_PATTERN = r'(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})'
 
 def parse_time(time_str):
     """Converte string de tempo SRT para milissegundos"""
@@ -29,9 +32,10 @@ def to_srt_time(milliseconds):
     milliseconds %= 1000
     return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
 
-def extract_embedded_subtitle(video_path):
+def extract_embedded_subtitle(video_path, output_path=None):
     """Extrai legendas de forma otimizada sem processar o vídeo inteiro"""
-    output_path = video_path.parent / "temp_embedded.srt"
+    if output_path is None:
+        output_path = video_path.parent / "temp_embedded.srt"
     
     # Tenta usar mkvextract para arquivos MKV (já é eficiente por padrão)
     if video_path.suffix.lower() == '.mkv':
@@ -162,16 +166,21 @@ def extract_embedded_subtitle(video_path):
 
 def get_first_subtitle_time(srt_path):
     """Obtém o tempo da primeira legenda válida"""
+    bytes_read = 0
     try:
-        with open(srt_path, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                time_match = re.match(r'(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})', line)
+        # Lido em binário para contar só os bytes realmente consumidos até a primeira marcação
+        with open(srt_path, 'rb') as f:
+            for raw_line in f:
+                bytes_read += len(raw_line)
+                time_match = re.match(SRT_TIME_PATTERN, raw_line.decode('utf-8', errors='ignore'))
                 if time_match:
                     return parse_time(time_match.group(1))
         return None
     except Exception as e:
         print(f"Erro ao ler arquivo de legenda {srt_path}: {str(e)}")
         return None
+    finally:
+        RUN_METRICS.add_bytes_read(bytes_read)
 
 def adjust_subtitle_time(content, offset_ms):
     """Ajusta todos os tempos na legenda com segurança"""
@@ -183,21 +192,90 @@ def adjust_subtitle_time(content, offset_ms):
         return f"{to_srt_time(new_start)} --> {to_srt_time(new_end)}"
     
     return re.sub(
-        r'(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})',
+        SRT_TIME_PATTERN,
         adjust_match,
         content
     )
 
+def get_first_subtitle_time_from_content(content):
+    """Obtém o tempo da primeira legenda válida a partir do texto já carregado"""
+    for line in content.splitlines():
+        time_match = re.match(SRT_TIME_PATTERN, line)
+        if time_match:
+            return parse_time(time_match.group(1))
+    return None
+
+def decode_subtitle_bytes(data):
+    """Decodifica uma legenda baixada sem perder caracteres.
+
+    Tenta UTF-8 (com ou sem BOM) e depois cp1252, comum em legendas pt-BR. Retorna
+    (texto, codificação para regravar) ou (None, None) se nenhuma servir.
+    """
+    encodings = ['utf-8-sig'] if data.startswith(b'\xef\xbb\xbf') else ['utf-8']
+    for encoding in encodings + ['cp1252']:
+        try:
+            return data.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    return None, None
+
+def sync_subtitle_content(video_file, content):
+    """Alinha uma legenda já em memória com a legenda embutida do vídeo.
+
+    Retorna o texto ajustado, ou None se não for possível calcular o offset.
+    """
+    video_file = Path(video_file)
+    # Nome temporário por vídeo para permitir várias threads na mesma pasta
+    embedded_output = video_file.with_name(f"{video_file.stem}.temp_embedded.srt")
+    try:
+        with RUN_METRICS.stage("extraction"):
+            embedded_srt = extract_embedded_subtitle(video_file, embedded_output)
+        if not embedded_srt:
+            return None
+        with RUN_METRICS.stage("alignment"):
+            embedded_time = get_first_subtitle_time(embedded_srt)
+            external_time = get_first_subtitle_time_from_content(content)
+            if None in [embedded_time, external_time]:
+                return None
+            return adjust_subtitle_time(content, embedded_time - external_time)
+    finally:
+        # Remove também extrações parciais (ex.: ffmpeg gerou arquivo vazio), que casariam
+        # com a busca de legendas alternativas do process_files
+        if embedded_output.exists():
+            try:
+                embedded_output.unlink()
+            except OSError:
+                pass
+
+def write_subtitle_atomic(srt_path, data):
+    """Grava a legenda em um arquivo temporário e renomeia de forma atômica"""
+    srt_path = Path(srt_path)
+    tmp_path = srt_path.with_name(srt_path.name + '.tmp')
+    # Grava sempre em binário: o texto baixado pode manter \r\n, e o modo texto
+    # no Windows o transformaria em \r\r\n
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    try:
+        with RUN_METRICS.stage("write"):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, srt_path)
+    except Exception:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
 def process_files(folder_path):
     """Processa todos os arquivos na pasta e em suas subpastas"""
     folder = Path(folder_path)
     
     # Alterado para rglob para busca recursiva
-    for video_file in folder.rglob('*.*'):
-        if video_file.suffix.lower() not in ['.mkv', '.mp4', '.avi', '.mov']:
-            continue
-        
+    with RUN_METRICS.stage("scan"):
+        video_files = [f for f in folder.rglob('*.*') if f.suffix.lower() in ['.mkv', '.mp4', '.avi', '.mov']]
+
+    for video_file in video_files:
         print(f"\nProcessando: {video_file.name}")
+        RUN_METRICS.increment("files_processed")
         
         # Verifica se há um arquivo SRT com nome correspondente
         srt_path = video_file.with_suffix('.srt')
@@ -220,26 +298,30 @@ def process_files(folder_path):
                 continue
         
         # Extrai legendas embutidas de forma otimizada
-        embedded_srt = extract_embedded_subtitle(video_file)
+        with RUN_METRICS.stage("extraction"):
+            embedded_srt = extract_embedded_subtitle(video_file)
         if not embedded_srt:
             print(f"Não foi possível extrair legenda embutida do vídeo.")
             continue
             
         try:
-            embedded_time = get_first_subtitle_time(embedded_srt)
-            external_time = get_first_subtitle_time(srt_path)
-            
-            if None in [embedded_time, external_time]:
-                print("Não foi possível detectar tempos válidos nas legendas")
-                continue
-                
-            offset = embedded_time - external_time
-            print(f"Offset calculado: {offset} ms")
-            
+            # Lê a legenda externa uma única vez e reutiliza o conteúdo
             with open(srt_path, 'r', encoding='utf-8', errors='ignore') as f:
                 content = f.read()
+            RUN_METRICS.add_bytes_read(os.path.getsize(srt_path))
+
+            with RUN_METRICS.stage("alignment"):
+                embedded_time = get_first_subtitle_time(embedded_srt)
+                external_time = get_first_subtitle_time_from_content(content)
                 
-            new_content = adjust_subtitle_time(content, offset)
+                if None in [embedded_time, external_time]:
+                    print("Não foi possível detectar tempos válidos nas legendas")
+                    continue
+                    
+                offset = embedded_time - external_time
+                print(f"Offset calculado: {offset} ms")
+                    
+                new_content = adjust_subtitle_time(content, offset)
             
             # Cria backup e salva ajustes
             backup_path = srt_path.with_suffix('.srt.bak')
@@ -247,8 +329,10 @@ def process_files(folder_path):
                 backup_path.unlink()
             srt_path.rename(backup_path)
             
-            with open(srt_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
+            with RUN_METRICS.stage("write"):
+                with open(srt_path, 'w', encoding='utf-8') as f:
+                    f.write(new_content)
+            RUN_METRICS.increment("subtitles_synced")
                 
             print(f"Legenda ajustada. Backup salvo em: {backup_path.name}")
             
@@ -271,11 +355,36 @@ if __name__ == "__main__":
         type=str,
         help='Caminho da pasta contendo os arquivos de vídeo e legendas'
     )
+    parser.add_argument(
+        '--relatorio',
+        type=str,
+        default=None,
+        help='Grava um relatório JSON com métricas da execução (tempos por etapa, bytes lidos)'
+    )
+    parser.add_argument(
+        '--prometheus',
+        type=str,
+        default=None,
+        help='Grava as métricas no formato texto do Prometheus neste arquivo'
+    )
+    parser.add_argument(
+        '--perfil',
+        type=str,
+        default=None,
+        help='Perfila a execução com cProfile e grava o resultado (.prof e .prof.txt)'
+    )
     args = parser.parse_args()
     
     if not Path(args.pasta).exists():
         print("Erro: Pasta especificada não existe!")
         exit(1)
         
-    process_files(args.pasta)
+    if args.perfil:
+        profiler = CallProfiler()
+        profiler.wrap(process_files)(args.pasta)
+        profiler.dump(args.perfil)
+        print(f"Perfil cProfile salvo em: {args.perfil}")
+    else:
+        process_files(args.pasta)
+    export_report(args.relatorio, args.prometheus)
     print("\nSincronização concluída com sucesso!")
@@ -0,0 +1,451 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import multiprocessing
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+import ajustar_legenda
+import main
+from metricas import RUN_METRICS
+
+try:
+    import resource # Indisponível no Windows
+except ImportError:
+    resource = None
+
+# --- Servidor local que imita a API do OpenSubtitles ---
+
+class StubState:
+    """ Configuração e contadores do servidor stub. Thread-safe. """
+
+    def __init__(self, latency_ms=0, quota=1000, rate_429=0.0, hash_miss_rate=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.quota = quota # Downloads permitidos por conta
+        self.rate_429 = rate_429 # Fração das requisições da API que recebem 429
+        self.hash_miss_rate = hash_miss_rate # Fração das buscas por hash sem resultado (força busca por nome)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.downloads = {}
+        self.subtitle_body = generate_srt(20).encode('utf-8')
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def consume_download(self, token):
+        """ Desconta um download da cota da conta. Retorna o restante ou None se esgotada. """
+        with self.lock:
+            used = self.downloads.get(token, 0)
+            if used >= self.quota:
+                return None
+            self.downloads[token] = used + 1
+            return self.quota - used - 1
+
+    def api_calls(self):
+        with self.lock:
+            return sum(count for endpoint, count in self.calls.items() if endpoint != "/files")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None # Definido por start_stub_server
+
+    def log_message(self, format, *args):
+        pass # Silencia o log padrão do http.server
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            return {}
+
+    def _token(self):
+        return self.headers.get("Authorization", "").replace("Bearer ", "")
+
+    def _api_prelude(self, endpoint):
+        """ Conta a chamada, aplica a latência e injeta 429. Retorna True se já respondeu. """
+        state = self.state
+        state.count(endpoint)
+        if state.latency:
+            time.sleep(state.latency)
+        if endpoint != "/files" and state.roll(state.rate_429):
+            self._send_json(429, {"message": "Too Many Requests"})
+            return True
+        return False
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path.endswith("/login"):
+            payload = self._read_json()
+            if self._api_prelude("/login"):
+                return
+            self._send_json(200, {"token": f"tok-{payload.get('username', '?')}"})
+        elif path.endswith("/download"):
+            payload = self._read_json()
+            if self._api_prelude("/download"):
+                return
+            remaining = self.state.consume_download(self._token())
+            if remaining is None:
+                self._send_json(406, {"message": "Download quota exceeded"})
+                return
+            host, port = self.server.server_address[:2]
+            link = f"http://{host}:{port}/files/{payload.get('file_id', 0)}.srt"
+            self._send_json(200, {"link": link, "remaining": remaining})
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.endswith("/subtitles"):
+            query = urlparse(self.path).query
+            if self._api_prelude("/subtitles"):
+                return
+            if "moviehash=" in query and self.state.roll(self.state.hash_miss_rate):
+                self._send_json(200, {"data": []})
+                return
+            file_id = zlib.crc32(query.encode('utf-8')) % 1000000
+            self._send_json(200, {"data": [{
+                "attributes": {"language": "pt-BR", "filename": f"{file_id}.srt", "files": [{"file_id": file_id}]}
+            }]})
+        elif path.startswith("/files/"):
+            self._api_prelude("/files")
+            body = self.state.subtitle_body
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-subrip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+
+def start_stub_server(state, backlog=128):
+    """ Sobe o stub em uma porta livre de localhost. Retorna (server, url_base_da_api).
+
+    O backlog padrão do socketserver é 5; com dezenas de workers o stub recusaria conexões
+    e o benchmark mediria as retentativas de SYN em vez do cliente. """
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server_class = type("StubHTTPServer", (ThreadingHTTPServer,), {"request_queue_size": backlog})
+    server = server_class(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="StubServer", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/api/v1"
+
+# --- Geradores de fixtures sintéticas ---
+
+def generate_videos(directory, count, size_bytes, seed=0, first_episode=1):
+    """ Cria `count` vídeos falsos com início e fim aleatórios, o que basta para o hash.
+
+    O miolo só vira buraco (sem ocupar disco) em sistemas de arquivos esparsos; no NTFS, por
+    exemplo, ele é gravado com zeros. Como hash_file lê só 64 KB de cada ponta, o tamanho
+    quase não muda o resultado. """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    size_bytes = max(size_bytes, 128 * 1024)
+    paths = []
+    for i in range(count):
+        path = directory / f"Serie.Sintetica.S01E{first_episode + i:03d}.1080p.WEB-DL.x264.mkv"
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(64 * 1024))
+            f.seek(size_bytes - 64 * 1024)
+            f.write(rng.randbytes(64 * 1024))
+        paths.append(path)
+    return paths
+
+
+def generate_srt(cue_count, first_ms=5000, spacing_ms=4000, duration_ms=2500, offset_ms=0, drift_ppm=0):
+    """ Gera uma legenda SRT. offset_ms desloca tudo; drift_ppm acumula erro proporcional ao tempo. """
+    blocks = []
+    for i in range(cue_count):
+        start = first_ms + i * spacing_ms
+        end = start + duration_ms
+        start += offset_ms + round(start * drift_ppm / 1_000_000)
+        end += offset_ms + round(end * drift_ppm / 1_000_000)
+        blocks.append(f"{i + 1}\n{ajustar_legenda.to_srt_time(start)} --> {ajustar_legenda.to_srt_time(end)}\nFala número {i + 1}\n")
+    return "\n".join(blocks)
+
+
+def generate_srt_pair(cue_count, offset_ms, drift_ppm=0):
+    """ Retorna (referência, legenda deslocada) com offset e drift conhecidos. """
+    return generate_srt(cue_count), generate_srt(cue_count, offset_ms=offset_ms, drift_ppm=drift_ppm)
+
+
+def subtitle_start_times(content):
+    return [ajustar_legenda.parse_time(m.group(1)) for m in re.finditer(ajustar_legenda.SRT_TIME_PATTERN, content)]
+
+
+def max_residual_ms(pairs):
+    """ Maior diferença entre os inícios das falas de cada par (referência, legenda ajustada). """
+    residual = 0
+    for reference_path, adjusted_path in pairs:
+        expected = subtitle_start_times(Path(reference_path).read_text(encoding='utf-8'))
+        adjusted = subtitle_start_times(Path(adjusted_path).read_text(encoding='utf-8'))
+        residual = max([residual] + [abs(a - b) for a, b in zip(expected, adjusted)])
+    return residual
+
+# --- Execução dos cenários ---
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+@contextlib.contextmanager
+def reference_extraction(reference_dir):
+    """ Substitui a extração via mkvextract/ffmpeg pela cópia da legenda de referência do vídeo. """
+    original = ajustar_legenda.extract_embedded_subtitle
+
+    def extract_from_reference(video_path, output_path=None):
+        output_path = output_path or video_path.parent / "temp_embedded.srt"
+        shutil.copyfile(Path(reference_dir) / f"{video_path.stem}.srt", output_path)
+        return output_path
+
+    ajustar_legenda.extract_embedded_subtitle = extract_from_reference
+    try:
+        yield
+    finally:
+        ajustar_legenda.extract_embedded_subtitle = original
+
+
+@contextlib.contextmanager
+def measure_memory(result, trace_allocations):
+    """ Preenche result com o pico de memória. tracemalloc é opcional pois deixa o Python ~10x mais lento. """
+    if trace_allocations:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if trace_allocations:
+            result["tracemalloc_pico_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+            tracemalloc.stop()
+        if resource is not None:
+            # ru_maxrss é o pico do processo; cada cenário roda em um processo próprio (run_isolated)
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            bytes_per_unit = 1 if sys.platform == "darwin" else 1024 # bytes no macOS, KB no Linux
+            result["rss_pico_mb"] = round(max_rss * bytes_per_unit / (1024 * 1024), 2)
+
+
+def timed(latencies, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def build_report(name, file_count, elapsed, latencies, memory, **extra):
+    return {
+        "cenario": name,
+        "arquivos": file_count,
+        "segundos": round(elapsed, 4),
+        "arquivos_por_segundo": round(file_count / elapsed, 2) if elapsed else None,
+        "latencia_p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "latencia_p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        **memory,
+        **extra,
+        "etapas": {stage: {"count": v["count"], "p50_seconds": v["p50_seconds"], "p99_seconds": v["p99_seconds"]}
+                   for stage, v in RUN_METRICS.to_dict()["stages"].items()},
+    }
+
+
+def run_download_scenario(args, workdir, sync=False):
+    """ Mede process_video_file/TokenManager contra o stub local. """
+    name = "download_sync" if sync else "download"
+    video_dir = Path(workdir) / name
+    generate_videos(video_dir, args.arquivos, args.tamanho_mb * 1024 * 1024, seed=args.semente)
+    reference_dir = Path(workdir) / f"{name}_referencias"
+    reference_dir.mkdir()
+    for video in video_dir.iterdir():
+        (reference_dir / f"{video.stem}.srt").write_text(generate_srt(20, offset_ms=args.offset_ms), encoding='utf-8')
+
+    state = StubState(args.latencia_ms, args.cota, args.taxa_429, args.taxa_falha_hash, args.semente)
+    server, api_url = start_stub_server(state, backlog=max(128, args.workers * 2))
+    accounts = [{"username": f"bench{i}", "password": "x"} for i in range(args.contas)]
+    original_api_url, original_sync = main.API_URL, main.SYNC_AFTER_DOWNLOAD
+    main.API_URL, main.SYNC_AFTER_DOWNLOAD = api_url, sync
+    RUN_METRICS.reset()
+    latencies = []
+    memory = {}
+    try:
+        with reference_extraction(reference_dir), measure_memory(memory, args.tracemalloc):
+            start = time.perf_counter()
+            video_files = main.find_videos_in_directory(str(video_dir))
+            token_manager = main.TokenManager(accounts, main.API_KEY, api_url, main.BASE_HEADERS)
+            worker = timed(latencies, main.process_video_file)
+            with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='SubWorker') as executor:
+                list(executor.map(lambda path: worker(path, token_manager), video_files))
+            elapsed = time.perf_counter() - start
+    finally:
+        main.API_URL, main.SYNC_AFTER_DOWNLOAD = original_api_url, original_sync
+        server.shutdown()
+        server.server_close()
+
+    saved_files = list(video_dir.glob("*.srt"))
+    saved = len(saved_files)
+    extra = {}
+    # Sem 429 injetado e com cota suficiente, toda legenda deveria ser salva: faltas indicam stub/cliente quebrado
+    if saved < len(video_files) and not args.taxa_429 and args.cota * args.contas >= len(video_files):
+        extra["erro"] = f"{len(video_files) - saved} legenda(s) não salva(s) sem 429 injetado nem cota esgotada"
+    if sync:
+        # No modo combinado cada legenda salva deve ter sido alinhada com a referência
+        extra["erro_residual_max_ms"] = max_residual_ms(
+            (reference_dir / srt.name, srt) for srt in saved_files
+        )
+        synced = RUN_METRICS.to_dict()["counters"].get("subtitles_synced", 0)
+        if synced < saved:
+            extra["erro"] = f"{saved - synced} legenda(s) salva(s) sem sincronizar"
+    return build_report(
+        name, len(video_files), elapsed, latencies, memory,
+        legendas_salvas=saved,
+        legendas_faltando=len(video_files) - saved,
+        **extra,
+        chamadas_api=state.api_calls(),
+        chamadas_api_por_arquivo=round(state.api_calls() / len(video_files), 2) if video_files else None,
+        chamadas_por_endpoint=dict(state.calls),
+        requisicoes_por_conta=RUN_METRICS.to_dict()["accounts"],
+    )
+
+
+def run_sync_scenario(args, workdir):
+    """ Mede ajustar_legenda.process_files com pares SRT de offset/drift conhecidos. """
+    video_dir = Path(workdir) / "sync"
+    reference_dir = Path(workdir) / "sync_referencias"
+    reference_dir.mkdir(parents=True)
+    # Uma pasta por vídeo para cronometrar process_files arquivo a arquivo
+    videos = []
+    for i in range(args.arquivos):
+        videos += generate_videos(video_dir / f"{i:04d}", 1, args.tamanho_mb * 1024 * 1024,
+                                  seed=args.semente + i, first_episode=i + 1)
+    for video in videos:
+        reference, shifted = generate_srt_pair(args.legendas, args.offset_ms, args.drift_ppm)
+        (reference_dir / f"{video.stem}.srt").write_text(reference, encoding='utf-8')
+        video.with_suffix('.srt').write_text(shifted, encoding='utf-8')
+
+    RUN_METRICS.reset()
+    latencies = []
+    memory = {}
+    process_one_folder = timed(latencies, ajustar_legenda.process_files)
+    with reference_extraction(reference_dir), measure_memory(memory, args.tracemalloc):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for video in videos:
+                process_one_folder(str(video.parent))
+        elapsed = time.perf_counter() - start
+
+    residual = max_residual_ms(
+        (reference_dir / f"{video.stem}.srt", video.with_suffix('.srt')) for video in videos
+    )
+    return build_report(
+        "sync", len(videos), elapsed, latencies, memory,
+        offset_ms=args.offset_ms,
+        drift_ppm=args.drift_ppm,
+        erro_residual_max_ms=residual,
+    )
+
+
+SCENARIOS = {
+    "download": lambda args, workdir: run_download_scenario(args, workdir),
+    "download_sync": lambda args, workdir: run_download_scenario(args, workdir, sync=True),
+    "sync": run_sync_scenario,
+}
+
+
+def run_scenario(name, args, workdir):
+    """ Ponto de entrada do processo filho: cada cenário tem seu próprio pico de memória. """
+    if not args.log:
+        logging.getLogger().setLevel(logging.CRITICAL) # main.py loga cada arquivo, re-login e erro esperado do stub
+    return SCENARIOS[name](args, workdir)
+
+
+def run_isolated(name, args, workdir):
+    # spawn: o filho não herda a memória (nem o pico de RSS) do processo pai
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_scenario, name, args, workdir).result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark offline do main.py e do ajustar_legenda.py com stub local da API e mídia sintética',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--cenario', choices=list(SCENARIOS) + ['todos'], default='todos', help='Cenário a executar')
+    parser.add_argument('--arquivos', type=int, default=200, help='Quantidade de vídeos sintéticos')
+    parser.add_argument('--tamanho-mb', type=int, default=1, help='Tamanho de cada vídeo em MB (só é barato em sistemas de arquivos esparsos; hash_file lê apenas 128 KB)')
+    parser.add_argument('--workers', type=int, default=main.MAX_WORKERS, help='Threads do cenário de download')
+    parser.add_argument('--contas', type=int, default=3, help='Contas falsas no TokenManager')
+    parser.add_argument('--latencia-ms', type=float, default=20, help='Latência de cada resposta do stub')
+    parser.add_argument('--cota', type=int, default=1000, help='Downloads permitidos por conta no stub')
+    parser.add_argument('--taxa-429', type=float, default=0.0, help='Fração das requisições da API que recebem 429')
+    parser.add_argument('--taxa-falha-hash', type=float, default=0.0, help='Fração das buscas por hash sem resultado')
+    parser.add_argument('--legendas', type=int, default=500, help='Falas por legenda sintética no cenário sync')
+    parser.add_argument('--offset-ms', type=int, default=-2350, help='Offset conhecido das legendas sintéticas')
+    parser.add_argument('--drift-ppm', type=float, default=0.0, help='Drift conhecido (partes por milhão)')
+    parser.add_argument('--semente', type=int, default=0, help='Semente dos geradores aleatórios')
+    parser.add_argument('--tracemalloc', action='store_true', help='Mede o pico de alocações Python (distorce os tempos)')
+    parser.add_argument('--log', action='store_true', help='Mantém os logs INFO do main.py')
+    parser.add_argument('--saida', type=str, default=None, help='Grava os resultados em JSON neste arquivo')
+    parser.add_argument('--min-arquivos-por-segundo', type=float, default=None, help='Falha (código 1) se algum cenário ficar abaixo')
+    parser.add_argument('--max-chamadas-por-arquivo', type=float, default=None, help='Falha (código 1) se algum cenário passar deste valor')
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.cenario == 'todos' else [args.cenario]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_legendas_") as workdir:
+        for scenario in names:
+            report = run_isolated(scenario, args, workdir)
+            results.append(report)
+            print(json.dumps({k: v for k, v in report.items() if k != "etapas"}, ensure_ascii=False))
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    failed = False
+    for report in results:
+        if "erro" in report:
+            print(f"FALHA: {report['cenario']}: {report['erro']}")
+            failed = True
+        if args.min_arquivos_por_segundo is not None and (report["arquivos_por_segundo"] or 0) < args.min_arquivos_por_segundo:
+            print(f"REGRESSÃO: {report['cenario']} abaixo de {args.min_arquivos_por_segundo} arquivos/s")
+            failed = True
+        per_file = report.get("chamadas_api_por_arquivo")
+        if args.max_chamadas_por_arquivo is not None and per_file is not None and per_file > args.max_chamadas_por_arquivo:
+            print(f"REGRESSÃO: {report['cenario']} acima de {args.max_chamadas_por_arquivo} chamadas/arquivo")
+            failed = True
+    exit(1 if failed else 0)
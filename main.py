@@ -7,7 +7,10 @@ import time
 import re
 import threading # Importar threading
 from concurrent.futures import ThreadPoolExecutor # Importar ThreadPoolExecutor
+from contextlib import nullcontext
 import logging # Usar logging para saída thread-safe
+from ajustar_legenda import decode_subtitle_bytes, sync_subtitle_content, write_subtitle_atomic
+from metricas import RUN_METRICS, CallProfiler, export_report
 
 # --- Configuração de Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(message)s')
@@ -29,6 +32,13 @@ BASE_HEADERS = {
 TARGET_LANGUAGES = "pt-br"
 RELOGIN_STATUS_CODES = {401, 403, 429}
 MAX_WORKERS = 30 # Número de threads concorrentes (ajuste conforme necessário)
+# Modo combinado: sincroniza a legenda com a embutida do vídeo logo após o download,
+# na mesma thread, sem precisar rodar ajustar_legenda.py depois.
+SYNC_AFTER_DOWNLOAD = False
+# Métricas da execução (None desativa): relatório JSON, arquivo texto Prometheus e perfil cProfile
+METRICS_REPORT_PATH = None
+METRICS_PROMETHEUS_PATH = None
+PROFILE_OUTPUT_PATH = None
 
 # --- Classe Gerenciadora de Token ---
 class TokenManager:
@@ -53,6 +63,7 @@ class TokenManager:
         try:
             # Usa BASE_HEADERS que já tem Api-Key
             response = requests.post(f"{self.api_url}/login", headers=self.base_headers, json=payload, timeout=15)
+            RUN_METRICS.record_request(account["username"], response.status_code)
             if response.status_code == 200:
                 data = response.json()
                 token = data.get("token")
@@ -112,9 +123,11 @@ def hash_file(file_path):
         if os.path.getsize(file_path) < 128 * 1024:
              # logging.warning(f"Arquivo {os.path.basename(file_path)} muito pequeno para hash.")
              return None
-        with open(file_path, "rb") as f:
-            data = f.read(64 * 1024); f.seek(-64 * 1024, os.SEEK_END); data += f.read(64 * 1024)
-        return hashlib.md5(data).hexdigest()
+        with RUN_METRICS.stage("hash"):
+            with open(file_path, "rb") as f:
+                data = f.read(64 * 1024); f.seek(-64 * 1024, os.SEEK_END); data += f.read(64 * 1024)
+            RUN_METRICS.add_bytes_read(len(data))
+            return hashlib.md5(data).hexdigest()
     except FileNotFoundError:
         logging.error(f"Arquivo não encontrado: {file_path}")
         return None
@@ -148,12 +161,14 @@ def clean_filename(filename):
     return cleaned_name
 
 
-def search_subtitle_by_hash(token, file_hash):
+def search_subtitle_by_hash(token, file_hash, username=None):
     # ... (código mantido, usar logging para erros) ...
     headers = {**BASE_HEADERS, "Authorization": f"Bearer {token}"}
     params = {"moviehash": file_hash, "languages": TARGET_LANGUAGES}
     try:
-        response = requests.get(f"{API_URL}/subtitles", headers=headers, params=params, timeout=20)
+        with RUN_METRICS.stage("search_hash"):
+            response = requests.get(f"{API_URL}/subtitles", headers=headers, params=params, timeout=20)
+        RUN_METRICS.record_request(username, response.status_code)
         if response.status_code == 200:
             data = response.json().get("data", [])
             return data, response.status_code
@@ -164,14 +179,16 @@ def search_subtitle_by_hash(token, file_hash):
         logging.error(f"Erro Conexão HASH (Hash: {file_hash}): {e}")
         return [], 599
 
-def search_subtitle_by_query(token, query_string):
+def search_subtitle_by_query(token, query_string, username=None):
     # ... (código mantido, usar logging para erros) ...
     if not query_string: return [], 0
     # logging.info(f"Buscando por NOME (Query): '{query_string}'...") # Log movido para worker
     headers = {**BASE_HEADERS, "Authorization": f"Bearer {token}"}
     params = {"query": query_string, "languages": TARGET_LANGUAGES}
     try:
-        response = requests.get(f"{API_URL}/subtitles", headers=headers, params=params, timeout=20)
+        with RUN_METRICS.stage("search_query"):
+            response = requests.get(f"{API_URL}/subtitles", headers=headers, params=params, timeout=20)
+        RUN_METRICS.record_request(username, response.status_code)
         if response.status_code == 200:
             data = response.json().get("data", [])
             return data, response.status_code
@@ -183,20 +200,22 @@ def search_subtitle_by_query(token, query_string):
         return [], 599
 
 
-def download_subtitle(token, subtitle_data, video_filepath):
-    # ... (código mantido, usar logging para erros e sucesso) ...
+def fetch_subtitle_content(token, subtitle_data, video_filepath, username=None):
+    """ Obtém o link e baixa o conteúdo da legenda para a memória. Retorna (bytes|None, status). """
     headers = {**BASE_HEADERS, "Authorization": f"Bearer {token}"}
     video_name = os.path.basename(video_filepath)
     try:
         if 'attributes' not in subtitle_data or 'files' not in subtitle_data['attributes'] or not subtitle_data['attributes']['files']:
              logging.error(f"Dados inválidos para download ({video_name}): {subtitle_data}")
-             return False, 0
+             return None, 0
         file_id = subtitle_data['attributes']['files'][0]['file_id']
         download_link_payload = {'file_id': file_id}
-        response_link = requests.post(f"{API_URL}/download", headers=headers, json=download_link_payload, timeout=15)
+        with RUN_METRICS.stage("download_link"):
+            response_link = requests.post(f"{API_URL}/download", headers=headers, json=download_link_payload, timeout=15)
+        RUN_METRICS.record_request(username, response_link.status_code)
         if response_link.status_code != 200:
             logging.warning(f"Erro link download ({video_name}, file_id {file_id}): Código {response_link.status_code}")
-            return False, response_link.status_code
+            return None, response_link.status_code
         download_info = response_link.json()
         download_url = download_info.get('link')
         remaining_downloads = download_info.get('remaining')
@@ -204,28 +223,64 @@ def download_subtitle(token, subtitle_data, video_filepath):
              logging.info(f"Downloads restantes (conta atual): {remaining_downloads}")
         if not download_url:
             logging.error(f"Link download não encontrado ({video_name}): {download_info}")
-            return False, 0
+            return None, 0
         logging.info(f"Baixando legenda para '{video_name}' de {download_url[:50]}...")
-        response_download = requests.get(download_url, stream=True, timeout=60)
-        response_download.raise_for_status()
-        video_basename = os.path.splitext(video_name)[0]
-        subtitle_filename = os.path.join(os.path.dirname(video_filepath), f"{video_basename}.srt")
-        with open(subtitle_filename, 'wb') as f:
-            for chunk in response_download.iter_content(chunk_size=8192): f.write(chunk)
-        logging.info(f"Legenda salva: {subtitle_filename}")
-        return True, 200
+        with RUN_METRICS.stage("download_body"):
+            response_download = requests.get(download_url, timeout=60)
+            response_download.raise_for_status()
+            content = response_download.content
+        RUN_METRICS.increment("downloaded_bytes", len(content))
+        return content, 200
     except requests.exceptions.Timeout:
          logging.error(f"Timeout download ({video_name}).")
-         return False, 599
+         return None, 599
     except requests.exceptions.RequestException as e:
         logging.error(f"Erro rede download ({video_name}): {e}")
-        return False, 599
+        return None, 599
     except KeyError as e:
         logging.error(f"Erro dados download ({video_name}, chave: {e}). Dados: {subtitle_data}")
-        return False, 0
+        return None, 0
     except Exception as e:
         logging.error(f"Erro inesperado download ({video_name}): {e}")
+        return None, 0
+
+def subtitle_path_for(video_filepath):
+    video_basename = os.path.splitext(os.path.basename(video_filepath))[0]
+    return os.path.join(os.path.dirname(video_filepath), f"{video_basename}.srt")
+
+def download_subtitle(token, subtitle_data, video_filepath, sync=False, username=None):
+    """ Baixa a legenda e grava ao lado do vídeo. Com sync=True, alinha em memória antes de gravar. """
+    content, status_code = fetch_subtitle_content(token, subtitle_data, video_filepath, username)
+    if content is None:
+        return False, status_code
+    video_name = os.path.basename(video_filepath)
+    subtitle_filename = subtitle_path_for(video_filepath)
+    data = content
+    if sync:
+        text, encoding = decode_subtitle_bytes(content)
+        try:
+            if text is None:
+                logging.warning(f"Codificação da legenda de '{video_name}' não reconhecida.")
+                adjusted = None
+            else:
+                adjusted = sync_subtitle_content(video_filepath, text)
+            if adjusted is not None:
+                # Regrava na codificação original; o ajuste só altera os tempos (ASCII)
+                data = adjusted.encode(encoding)
+                RUN_METRICS.increment("subtitles_synced")
+                logging.info(f"Legenda sincronizada em memória para '{video_name}'.")
+            else:
+                logging.warning(f"Não foi possível sincronizar '{video_name}'. Salvando legenda sem ajuste.")
+        except Exception as e:
+            logging.error(f"Erro ao sincronizar legenda de '{video_name}': {e}. Salvando sem ajuste.")
+    try:
+        write_subtitle_atomic(subtitle_filename, data)
+    except OSError as e:
+        logging.error(f"Erro ao salvar legenda ({video_name}): {e}")
         return False, 0
+    RUN_METRICS.increment("subtitles_saved")
+    logging.info(f"Legenda salva: {subtitle_filename}")
+    return True, 200
 
 def find_videos_in_directory(directory):
     # ... (código mantido, usar logging) ...
@@ -233,14 +288,15 @@ def find_videos_in_directory(directory):
     video_files = []
     logging.info(f"Procurando vídeos em: {directory}")
     count = 0
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith(video_extensions):
-                base_name, _ = os.path.splitext(file)
-                srt_file = os.path.join(root, base_name + ".srt")
-                if not os.path.exists(srt_file):
-                    video_files.append(os.path.join(root, file))
-                    count +=1
+    with RUN_METRICS.stage("scan"):
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if file.lower().endswith(video_extensions):
+                    base_name, _ = os.path.splitext(file)
+                    srt_file = os.path.join(root, base_name + ".srt")
+                    if not os.path.exists(srt_file):
+                        video_files.append(os.path.join(root, file))
+                        count +=1
     logging.info(f"Encontrados {count} vídeos sem legenda .srt correspondente.")
     return video_files
 
@@ -250,6 +306,7 @@ def process_video_file(video_path, token_manager):
     thread_name = threading.current_thread().name
     video_name = os.path.basename(video_path)
     logging.info(f"Processando: {video_name}")
+    RUN_METRICS.increment("files_processed")
 
     try:
         token, account = token_manager.get_token() # Obtém token inicial (pode logar aqui)
@@ -271,7 +328,7 @@ def process_video_file(video_path, token_manager):
 
         while search_attempts < max_search_attempts:
             # Busca por Hash
-            subtitles_hash, status_code_hash = search_subtitle_by_hash(token, file_hash)
+            subtitles_hash, status_code_hash = search_subtitle_by_hash(token, file_hash, logged_in_username)
 
             if subtitles_hash: # Encontrou por Hash
                 # logging.info(f"Legenda encontrada via HASH para {video_name}.")
@@ -304,7 +361,7 @@ def process_video_file(video_path, token_manager):
                  logging.info(f"Buscando por NOME '{cleaned_name}' [{TARGET_LANGUAGES}] com conta '{logged_in_username}'")
                  query_attempts = 0
                  while query_attempts < max_search_attempts:
-                     subtitles_query, status_code_query = search_subtitle_by_query(token, cleaned_name)
+                     subtitles_query, status_code_query = search_subtitle_by_query(token, cleaned_name, logged_in_username)
 
                      if subtitles_query: # Encontrou por Query
                          # logging.info(f"Legenda encontrada via NOME para {video_name}.")
@@ -341,7 +398,7 @@ def process_video_file(video_path, token_manager):
 
         download_attempts = 0
         while download_attempts < max_search_attempts: # Reusa max_search_attempts para download também
-            download_success, download_status_code = download_subtitle(token, best_subtitle, video_path)
+            download_success, download_status_code = download_subtitle(token, best_subtitle, video_path, sync=SYNC_AFTER_DOWNLOAD, username=logged_in_username)
 
             if download_success:
                 break # Download OK
@@ -401,11 +458,15 @@ if __name__ == "__main__":
             else:
                 # Cria e gerencia o pool de threads
                 # Usar context manager garante que as threads terminem antes de sair
-                with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='SubWorker') as executor:
+                # Hook opcional de cProfile: perfila a execução inteira e, até o Python 3.11, cada worker
+                profiler = CallProfiler() if PROFILE_OUTPUT_PATH else None
+                worker = profiler.wrap(process_video_file) if profiler else process_video_file
+                with (profiler.profile() if profiler else nullcontext()), \
+                     ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='SubWorker') as executor:
                     logging.info(f"Iniciando processamento de {len(video_files)} arquivos com {MAX_WORKERS} workers...")
                     # Submete cada tarefa ao executor
                     # executor.map é uma alternativa, mas submit dá mais controle se precisarmos dos Futures
-                    futures = [executor.submit(process_video_file, video_path, token_manager) for video_path in video_files]
+                    futures = [executor.submit(worker, video_path, token_manager) for video_path in video_files]
 
                     # Aguarda a conclusão de todas as tarefas (opcional, o 'with' já faz isso no exit)
                     # for future in concurrent.futures.as_completed(futures):
@@ -415,6 +476,9 @@ if __name__ == "__main__":
                     #         logging.error(f'Thread gerou uma exceção: {exc}')
 
                 logging.info("Todas as tarefas foram submetidas e/ou concluídas.")
+                if profiler:
+                    profiler.dump(PROFILE_OUTPUT_PATH)
+                    logging.info(f"Perfil cProfile salvo em: {PROFILE_OUTPUT_PATH}")
 
     except KeyboardInterrupt:
         logging.info("\nOperação cancelada pelo usuário.")
@@ -424,4 +488,11 @@ if __name__ == "__main__":
         import traceback
         traceback.print_exc()
 
+    try:
+        export_report(METRICS_REPORT_PATH, METRICS_PROMETHEUS_PATH)
+        if METRICS_REPORT_PATH:
+            logging.info(f"Relatório de métricas salvo em: {METRICS_REPORT_PATH}")
+    except OSError as e:
+        logging.error(f"Erro ao salvar relatório de métricas: {e}")
+
     logging.info("\nProcesso principal concluído.")
\ No newline at end of file
@@ -0,0 +1,218 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites dos buckets do histograma de latência (segundos), no estilo Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class RunMetrics:
+    """ Coleta métricas de uma execução (tempos por etapa, contadores por conta, bytes lidos). Thread-safe. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.stages = {}
+            self.accounts = {}
+            self.bytes_read = 0
+            self.counters = {}
+
+    def _stage_entry(self, name):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = {
+                "count": 0,
+                "total_seconds": 0.0,
+                "min_seconds": None,
+                "max_seconds": 0.0,
+                "buckets": [0] * (len(LATENCY_BUCKETS) + 1), # último = +Inf
+            }
+            self.stages[name] = entry
+        return entry
+
+    def observe(self, stage, seconds):
+        """ Registra a duração de uma etapa no histograma. """
+        with self.lock:
+            entry = self._stage_entry(stage)
+            entry["count"] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            if entry["min_seconds"] is None or seconds < entry["min_seconds"]:
+                entry["min_seconds"] = seconds
+            for i, limit in enumerate(LATENCY_BUCKETS):
+                if seconds <= limit:
+                    entry["buckets"][i] += 1
+                    break
+            else:
+                entry["buckets"][-1] += 1
+
+    @contextmanager
+    def stage(self, name):
+        """ Cronometra o bloco como uma etapa: `with RUN_METRICS.stage("hash"): ...` """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def record_request(self, account, status_code):
+        """ Conta uma requisição à API feita com a conta informada (e os 429 recebidos). """
+        account = account or "N/A"
+        with self.lock:
+            entry = self.accounts.setdefault(account, {"requests": 0, "status_429": 0})
+            entry["requests"] += 1
+            if status_code == 429:
+                entry["status_429"] += 1
+
+    def add_bytes_read(self, count):
+        with self.lock:
+            self.bytes_read += count
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @staticmethod
+    def _quantile(entry, q):
+        """ Estima um quantil pelo limite superior do bucket do histograma. """
+        if not entry["count"]:
+            return None
+        target = q * entry["count"]
+        cumulative = 0
+        for i, bucket_count in enumerate(entry["buckets"]):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else entry["max_seconds"]
+        return entry["max_seconds"]
+
+    def to_dict(self):
+        with self.lock:
+            stages = {}
+            for name, entry in self.stages.items():
+                stages[name] = {
+                    **entry,
+                    "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], entry["buckets"])),
+                    "mean_seconds": entry["total_seconds"] / entry["count"] if entry["count"] else None,
+                    "p50_seconds": self._quantile(entry, 0.50),
+                    "p99_seconds": self._quantile(entry, 0.99),
+                }
+            return {
+                "started_at": self.started_at,
+                "elapsed_seconds": time.time() - self.started_at,
+                "stages": stages,
+                "accounts": {name: dict(values) for name, values in self.accounts.items()},
+                "bytes_read": self.bytes_read,
+                "counters": dict(self.counters),
+            }
+
+    def write_json(self, path):
+        """ Grava o relatório da execução em JSON. """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+    def to_prometheus(self, prefix="legendas"):
+        """ Exporta as métricas no formato texto do Prometheus. """
+        report = self.to_dict()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Duração de cada etapa.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for name, entry in report["stages"].items():
+            cumulative = 0
+            for limit, bucket_count in entry["buckets"].items():
+                cumulative += bucket_count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{limit}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {entry["total_seconds"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {entry["count"]}')
+        lines.append(f"# TYPE {prefix}_api_requests_total counter")
+        for account, values in report["accounts"].items():
+            lines.append(f'{prefix}_api_requests_total{{account="{account}"}} {values["requests"]}')
+        lines.append(f"# TYPE {prefix}_api_429_total counter")
+        for account, values in report["accounts"].items():
+            lines.append(f'{prefix}_api_429_total{{account="{account}"}} {values["status_429"]}')
+        lines.append(f"# TYPE {prefix}_bytes_read_total counter")
+        lines.append(f"{prefix}_bytes_read_total {report['bytes_read']}")
+        for name, value in report["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+
+
+# Instância compartilhada pelos dois scripts (e pelo modo combinado do main.py)
+RUN_METRICS = RunMetrics()
+
+
+class CallProfiler:
+    """ Hook opcional de cProfile. `profile()` perfila um bloco na thread atual e `wrap()` perfila
+    cada chamada de um worker; os resultados são somados.
+
+    Até o Python 3.11 o cProfile é por thread, então cada worker embrulhado tem seu próprio perfil.
+    A partir do 3.12 só pode haver um profiler ativo no processo, mas ele cobre todas as threads:
+    quem não consegue ativar o seu simplesmente roda sem perfil próprio. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = None
+
+    def _start(self):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return None # 3.12+: já existe um profiler ativo no processo
+        return profiler
+
+    def _finish(self, profiler):
+        profiler.disable()
+        profiler.create_stats()
+        if not profiler.stats:
+            return
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+
+    @contextmanager
+    def profile(self):
+        profiler = self._start()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                self._finish(profiler)
+
+    def wrap(self, func):
+        def wrapper(*args, **kwargs):
+            with self.profile():
+                return func(*args, **kwargs)
+        return wrapper
+
+    def dump(self, path):
+        """ Grava o .prof (para snakeviz/pstats) e um resumo em texto em `path`.txt. """
+        with self.lock:
+            if self.stats is None:
+                return
+            self.stats.dump_stats(path)
+            with open(f"{path}.txt", 'w', encoding='utf-8') as f:
+                self.stats.stream = f
+                self.stats.sort_stats("cumulative").print_stats(40)
+
+
+def export_report(report_path=None, prometheus_path=None):
+    """ Grava os relatórios configurados. Caminhos vazios/None são ignorados. """
+    if report_path:
+        RUN_METRICS.write_json(report_path)
+    if prometheus_path:
+        RUN_METRICS.write_prometheus(prometheus_path)